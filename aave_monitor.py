@@ -1,14 +1,78 @@
 import asyncio
-import json
+import hashlib
 import os
-from datetime import datetime
-from typing import Dict, Optional, List
-import random
-
-from web3 import Web3
+from datetime import datetime, timedelta
+from typing import Dict, Optional, List, Set, Tuple
+import time
+
+import aiohttp
+import eth_abi
+import numpy as np
+import orjson
+from eth_utils import function_signature_to_4byte_selector
+from web3 import AsyncWeb3, Web3
+from web3.providers.rpc import AsyncHTTPProvider
 from web3.exceptions import Web3Exception
 from telegram import Bot
-from telegram.error import TelegramError
+from telegram.error import RetryAfter, TelegramError
+
+
+class FastAsyncHTTPProvider(AsyncHTTPProvider):
+    """AsyncHTTPProvider that (de)serializes JSON-RPC payloads with orjson"""
+
+    def encode_rpc_request(self, method, params) -> bytes:
+        try:
+            return orjson.dumps(self.form_request(method, params))
+        except TypeError:
+            # Params orjson can't serialize (e.g. HexBytes) go through web3's encoder
+            return super().encode_rpc_request(method, params)
+
+    def decode_rpc_response(self, raw_response: bytes):
+        return orjson.loads(raw_response)
+
+
+# Web3 transports shared by every monitor in the process, keyed by RPC URL.
+# Per-monitor provider state (failed_count, ewma_ms, ...) lives on the monitor.
+_PROVIDERS: Dict[str, Tuple[AsyncWeb3, aiohttp.ClientSession]] = {}
+_PROVIDERS_LOCK: Optional[asyncio.Lock] = None
+
+
+async def get_shared_web3(rpc_url: str) -> AsyncWeb3:
+    """Get the process-wide AsyncWeb3 for an RPC URL, creating it on first use"""
+    global _PROVIDERS_LOCK
+    if _PROVIDERS_LOCK is None:
+        _PROVIDERS_LOCK = asyncio.Lock()
+
+    async with _PROVIDERS_LOCK:
+        if rpc_url not in _PROVIDERS:
+            # Keep-alive session so connections survive across ticks
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=16,
+                    keepalive_timeout=75,
+                    ttl_dns_cache=300
+                )
+            )
+
+            w3 = AsyncWeb3(FastAsyncHTTPProvider(
+                rpc_url,
+                request_kwargs={'timeout': 30}
+            ))
+
+            # Read-only eth_calls need none of the default middlewares
+            w3.middleware_onion.clear()
+
+            await w3.provider.cache_async_session(session)
+            _PROVIDERS[rpc_url] = (w3, session)
+
+        return _PROVIDERS[rpc_url][0]
+
+
+async def close_shared_web3():
+    """Close all pooled HTTP sessions, call once at process shutdown"""
+    for _, session in _PROVIDERS.values():
+        await session.close()
+    _PROVIDERS.clear()
 
 
 class AAVEMonitorEnhanced:
@@ -42,6 +106,55 @@ class AAVEMonitorEnhanced:
         }
     ]
 
+    # Multicall3 is deployed at the same address on all supported networks
+    MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+    MULTICALL3_ABI = [
+        {
+            "inputs": [
+                {
+                    "components": [
+                        {"internalType": "address", "name": "target", "type": "address"},
+                        {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                        {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                    ],
+                    "internalType": "struct Multicall3.Call3[]",
+                    "name": "calls",
+                    "type": "tuple[]"
+                }
+            ],
+            "name": "aggregate3",
+            "outputs": [
+                {
+                    "components": [
+                        {"internalType": "bool", "name": "success", "type": "bool"},
+                        {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                    ],
+                    "internalType": "struct Multicall3.Result[]",
+                    "name": "returnData",
+                    "type": "tuple[]"
+                }
+            ],
+            "stateMutability": "payable",
+            "type": "function"
+        }
+    ]
+
+    ACCOUNT_DATA_TYPES = ['uint256'] * 6
+
+    # Below this many positions NumPy's fixed overhead outweighs vectorizing
+    VECTORIZE_MIN_POSITIONS = 16
+
+    NETWORK_EMOJI = {
+        "ethereum": "🔷",
+        "polygon": "🟣",
+        "arbitrum": "🔵",
+        "optimism": "🔴"
+    }
+
+    # Number format strings per decimals, filled by _format_number
+    _NUMBER_FORMATS: Dict[int, Tuple[str, str, str]] = {}
+
     # Multiple RPC providers for each network with failover
     NETWORKS = {
         "ethereum": {
@@ -103,85 +216,234 @@ class AAVEMonitorEnhanced:
         self.telegram_token = self.config.get("telegram_token")
         self.telegram_chat_id = self.config.get("telegram_chat_id")
         self.update_interval = self.config.get("update_interval", 60)
+        # Number of providers raced per call (1 disables hedging)
+        self.hedge_factor = self.config.get("hedge_factor", 1)
+        self.use_multicall = self.config.get("multicall", True)
+        # Some RPCs answer batches slower than concurrent single calls
+        self.use_batch = self.config.get("batch_requests", True)
 
         # Get network config
         self.network_config = self.NETWORKS[self.network]
 
-        # Initialize Web3 connections
+        # Static part of the Telegram message header
+        emoji = self.NETWORK_EMOJI.get(self.network, "📊")
+        self._message_header = f"{emoji} <b>AAVE Monitor - {self.network.upper()}</b>\n"
+
+        # Checksum addresses and getUserAccountData calldata never change, compute once
+        selector = function_signature_to_4byte_selector("getUserAccountData(address)")
+        self._addresses_checksum = {
+            address: Web3.to_checksum_address(address) for address in self.addresses
+        }
+        self._calldata = {
+            address: selector + eth_abi.encode(['address'], [checksum_address])
+            for address, checksum_address in self._addresses_checksum.items()
+        }
+        self._calldata_hex = {
+            address: '0x' + calldata.hex() for address, calldata in self._calldata.items()
+        }
+        self._pool_addr = Web3.to_checksum_address(self.network_config["pool"])
+
+        # Web3 connections are set up by _init_web3_providers in run()
         self.w3_providers = []
-        self.current_rpc_index = 0
-        self._init_web3_providers()
+
+        # Position data keyed by (address, block_number)
+        self._pos_cache: Dict[Tuple[str, int], Dict] = {}
+
+        # Adaptive polling: faster when a position is at risk, slower when all are safe
+        self._poll_interval = self.update_interval
+        self.min_update_interval = self.config.get("min_update_interval", self.update_interval / 4)
+        # Only reached while every HF is above 2.0, any riskier position resets to update_interval
+        self.max_update_interval = self.config.get("max_update_interval", self.update_interval * 4)
+        self._last_block_number = None
+        self._last_health_factors: List[float] = []
 
         # Initialize Telegram bot
         self.bot = Bot(token=self.telegram_token)
         self.message_id = None
+        self._last_text_hash = None
+
+        # Resume editing the same message after a restart
+        self._state_path = self.config.get("state_path", "aave_monitor_state.json")
+        self._load_state()
+
+        # Throttle Telegram calls to one per second
+        self._tg_semaphore = asyncio.Semaphore(1)
+        self._tg_last_send = 0.0
+        # Monotonic time until which Telegram asked us to back off
+        self._tg_blocked_until = 0.0
 
     def _load_config(self, config_path: str) -> dict:
         """Load configuration"""
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file not found: {config_path}")
 
-        with open(config_path, 'r') as f:
-            return json.load(f)
+        with open(config_path, 'rb') as f:
+            return orjson.loads(f.read())
 
-    def _init_web3_providers(self):
-        """Initialize Web3 providers for all RPCs"""
-        rpcs = self.network_config["rpcs"].copy()
-        random.shuffle(rpcs)  # Randomize to distribute load
+    def _load_state(self):
+        """Restore message_id and last text hash from the state file"""
+        if not os.path.exists(self._state_path):
+            return
 
-        for rpc_url in rpcs:
-            try:
-                w3 = Web3(Web3.HTTPProvider(
-                    rpc_url,
-                    request_kwargs={'timeout': 30}
-                ))
-
-                pool_contract = w3.eth.contract(
-                    address=Web3.to_checksum_address(self.network_config["pool"]),
-                    abi=self.POOL_ABI
-                )
+        try:
+            with open(self._state_path, 'rb') as f:
+                state = orjson.loads(f.read())
 
-                self.w3_providers.append({
-                    'w3': w3,
-                    'contract': pool_contract,
-                    'url': rpc_url,
-                    'failed_count': 0
-                })
+            self.message_id = state.get("message_id")
+            last_text_hash = state.get("last_text_hash")
+            self._last_text_hash = bytes.fromhex(last_text_hash) if last_text_hash else None
+        except Exception as e:
+            print(f"⚠️  Could not load state from {self._state_path}: {e}")
 
-            except Exception as e:
-                print(f"⚠️  Could not initialize RPC {rpc_url}: {e}")
+    def _save_state(self):
+        """Atomically write message_id and last text hash to the state file"""
+        state = {
+            "message_id": self.message_id,
+            "last_text_hash": self._last_text_hash.hex() if self._last_text_hash else None
+        }
 
-        if not self.w3_providers:
-            raise Exception("No working RPC providers found!")
+        tmp_path = f"{self._state_path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(state))
+            os.replace(tmp_path, self._state_path)
+        except OSError as e:
+            print(f"⚠️  Could not save state to {self._state_path}: {e}")
 
-        print(f"✓ Initialized {len(self.w3_providers)} RPC provider(s)")
+    # Latency assumed for RPCs that missed the startup probe (its timeout)
+    UNPROBED_LATENCY_MS = 3000.0
 
-    def _get_working_provider(self):
-        """Get a working Web3 provider with failover"""
-        attempts = 0
-        max_attempts = len(self.w3_providers) * 2
+    async def _probe(self, rpc_url: str) -> Optional[dict]:
+        """Create a provider for an RPC and check it serves the expected chain
 
-        while attempts < max_attempts:
-            provider = self.w3_providers[self.current_rpc_index]
+        RPCs that don't answer are kept and re-probed by _get_working_provider,
+        only RPCs on the wrong chain are dropped.
+        """
+        try:
+            w3 = await get_shared_web3(rpc_url)
 
-            # Skip providers that failed too many times
-            if provider['failed_count'] < 3:
-                try:
-                    # Quick connectivity check
-                    if provider['w3'].is_connected():
-                        return provider
-                except:
-                    pass
+            multicall_contract = w3.eth.contract(
+                address=Web3.to_checksum_address(self.MULTICALL3_ADDRESS),
+                abi=self.MULTICALL3_ABI
+            )
+        except Exception as e:
+            print(f"⚠️  Could not initialize RPC {rpc_url}: {e}")
+            return None
+
+        provider = {
+            'w3': w3,
+            'multicall': multicall_contract,
+            'url': rpc_url,
+            'failed_count': 0,
+            'ewma_ms': self.UNPROBED_LATENCY_MS,  # Smoothed call latency, seeded by the probe
+            'err_rate': 0.0,  # Smoothed failure rate
+            'alive_until': 0.0,  # Not checked yet
+            'alive_check': None  # In-flight liveness check shared by callers
+        }
+
+        try:
+            started = time.perf_counter()
+            chain_id = await asyncio.wait_for(w3.eth.chain_id, timeout=3)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if chain_id != self.network_config["chain_id"]:
+                print(f"⚠️  RPC {rpc_url} is on chain {chain_id}, expected {self.network_config['chain_id']}")
+                return None
+
+            provider['ewma_ms'] = elapsed_ms
+            provider['alive_until'] = time.monotonic() + 30  # Just answered chain_id
+
+        except asyncio.TimeoutError:
+            print(f"⚠️  RPC {rpc_url} did not respond in time, will retry later")
+        except Exception as e:
+            print(f"⚠️  RPC {rpc_url} is not reachable, will retry later: {str(e)[:100]}")
+
+        return provider
+
+    async def _init_web3_providers(self):
+        """Initialize async Web3 providers, probing all RPCs in parallel"""
+        rpcs = self.network_config["rpcs"]
 
-            # Move to next provider
-            self.current_rpc_index = (self.current_rpc_index + 1) % len(self.w3_providers)
-            attempts += 1
+        providers = await asyncio.gather(*(self._probe(rpc_url) for rpc_url in rpcs))
+
+        # Fastest responders first so the first tick starts on the best RPC,
+        # ones that missed the probe go last
+        self.w3_providers = sorted(
+            (provider for provider in providers if provider is not None),
+            key=lambda p: p['ewma_ms']
+        )
+
+        if not self.w3_providers:
+            raise Exception("No RPC providers for this network!")
+
+        alive = sum(1 for p in self.w3_providers if p['alive_until'] > 0)
+        print(f"✓ Initialized {len(self.w3_providers)} RPC provider(s), {alive} responding")
+
+    def _provider_score(self, provider: dict) -> float:
+        """Lower is better: latency penalized by recent failures"""
+        return provider['ewma_ms'] * (1 + 5 * provider['err_rate'])
+
+    def _ranked_providers(self) -> List[dict]:
+        """Providers ordered by score, ones that failed too many times last"""
+        return sorted(
+            self.w3_providers,
+            key=lambda p: (p['failed_count'] >= 3, self._provider_score(p))
+        )
+
+    def _record_success(self, provider: dict, started: float):
+        """Update provider health after a successful call"""
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        provider['ewma_ms'] = 0.8 * provider['ewma_ms'] + 0.2 * elapsed_ms
+        provider['err_rate'] *= 0.9
+        provider['failed_count'] = 0
+
+    def _record_failure(self, provider: dict):
+        """Update provider health after a failed call"""
+        provider['err_rate'] = 0.9 * provider['err_rate'] + 0.1
+        provider['failed_count'] += 1
+        # Re-probe before it is used again
+        provider['alive_until'] = 0.0
+
+    async def _check_alive(self, provider: dict) -> bool:
+        """Check provider liveness, concurrent callers share one in-flight check"""
+        if provider['alive_check'] is None:
+            provider['alive_check'] = asyncio.ensure_future(self._run_alive_check(provider))
+
+        # Shield so a cancelled caller doesn't cancel the check for the others
+        return await asyncio.shield(provider['alive_check'])
+
+    async def _run_alive_check(self, provider: dict) -> bool:
+        """Cheap chain_id liveness check, cached for 30s"""
+        try:
+            await asyncio.wait_for(provider['w3'].eth.chain_id, timeout=2.0)
+            provider['alive_until'] = time.monotonic() + 30
+            return True
+        except Exception:
+            self._record_failure(provider)
+            return False
+        finally:
+            provider['alive_check'] = None
+
+    async def _get_working_provider(self, exclude: Optional[Set[str]] = None):
+        """Get the best scoring working Web3 provider, skipping URLs in exclude"""
+        exclude = exclude or set()
+
+        for provider in self._ranked_providers():
+            # Skip providers already tried or that failed too many times
+            if provider['url'] in exclude or provider['failed_count'] >= 3:
+                continue
+
+            if provider['alive_until'] <= time.monotonic():
+                if not await self._check_alive(provider):
+                    continue
+
+            return provider
 
         # Reset fail counts and try again
         for p in self.w3_providers:
             p['failed_count'] = 0
 
-        return self.w3_providers[0]
+        candidates = [p for p in self.w3_providers if p['url'] not in exclude] or self.w3_providers
+        return min(candidates, key=self._provider_score)
 
     def _calculate_liquidation_price(self, collateral_usd: float, debt_usd: float,
                                      liquidation_threshold: float, health_factor: float) -> Optional[float]:
@@ -227,89 +489,327 @@ class AAVEMonitorEnhanced:
             print(f"Error calculating liquidation price: {e}")
             return None
 
-    async def get_position_data(self, address: str) -> Optional[Dict]:
+    async def _call_account_data(self, provider: dict, address: str, block_identifier='latest') -> tuple:
+        """Call getUserAccountData with a raw eth_call, bypassing the contract layer"""
+        raw = await provider['w3'].eth.call(
+            {'to': self._pool_addr, 'data': self._calldata_hex[address]}, block_identifier
+        )
+        return eth_abi.decode(self.ACCOUNT_DATA_TYPES, raw)
+
+    async def _get_position_data_hedged(self, address: str, tried: Set[str],
+                                        block_identifier='latest') -> Dict:
+        """Race the same call against several providers, first success wins
+
+        URLs of providers that failed are added to tried.
+        """
+        providers = [p for p in self._ranked_providers() if p['url'] not in tried][:self.hedge_factor]
+
+        started = time.perf_counter()
+        tasks = {
+            asyncio.create_task(self._call_account_data(p, address, block_identifier)): p
+            for p in providers
+        }
+        pending = set(tasks)
+        last_error = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                # Look at every finished task so no failure goes unrecorded
+                winner = None
+                for task in done:
+                    provider = tasks[task]
+                    if task.exception() is None:
+                        if winner is None:
+                            winner = task
+                        continue
+
+                    self._record_failure(provider)
+                    tried.add(provider['url'])
+                    last_error = task.exception()
+
+                if winner is not None:
+                    provider = tasks[winner]
+                    self._record_success(provider, started)
+                    return self._parse_account_data(address, winner.result(), provider['url'])
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    async def get_position_data(self, address: str, block_identifier='latest') -> Optional[Dict]:
         """Get position data with RPC failover"""
+        # Providers that already failed for this call are not retried
+        tried: Set[str] = set()
+
+        if self.hedge_factor > 1:
+            try:
+                return await self._get_position_data_hedged(address, tried, block_identifier)
+            except Exception as e:
+                print(f"⚠️  Hedged request failed for {address[:8]}...: {str(e)[:100]}")
+
         max_retries = len(self.w3_providers)
 
         for retry in range(max_retries):
-            provider = self._get_working_provider()
+            if len(tried) >= len(self.w3_providers):
+                break
 
-            try:
-                checksum_address = Web3.to_checksum_address(address)
+            provider = await self._get_working_provider(exclude=tried)
+            tried.add(provider['url'])
 
+            try:
                 # Get user account data
-                account_data = provider['contract'].functions.getUserAccountData(
-                    checksum_address
-                ).call()
-
-                # Reset fail count on success
-                provider['failed_count'] = 0
-
-                # Parse data
-                total_collateral = account_data[0] / 1e8
-                total_debt = account_data[1] / 1e8
-                available_borrows = account_data[2] / 1e8
-                liquidation_threshold = account_data[3] / 1e4  # Percentage (e.g., 82.5%)
-                ltv = account_data[4] / 1e4
-                health_factor = account_data[5] / 1e18
-
-                # Calculate liquidation price
-                liq_price_data = self._calculate_liquidation_price(
-                    total_collateral,
-                    total_debt,
-                    liquidation_threshold / 100,  # Convert to decimal
-                    health_factor
-                )
+                started = time.perf_counter()
+                account_data = await self._call_account_data(provider, address, block_identifier)
 
-                return {
-                    "address": address,
-                    "collateral_usd": total_collateral,
-                    "debt_usd": total_debt,
-                    "available_borrows_usd": available_borrows,
-                    "health_factor": health_factor,
-                    "liquidation_threshold": liquidation_threshold,
-                    "ltv": ltv,
-                    "liquidation_price_data": liq_price_data,
-                    "timestamp": datetime.now().isoformat(),
-                    "rpc_used": provider['url']
-                }
+                self._record_success(provider, started)
+
+                return self._parse_account_data(address, account_data, provider['url'])
 
             except Exception as e:
-                provider['failed_count'] += 1
+                self._record_failure(provider)
                 print(f"⚠️  RPC {provider['url']} failed (attempt {retry + 1}/{max_retries}): {str(e)[:100]}")
 
-                # Try next provider
-                self.current_rpc_index = (self.current_rpc_index + 1) % len(self.w3_providers)
-
-                if retry < max_retries - 1:
+                if retry < max_retries - 1 and len(tried) < len(self.w3_providers):
                     await asyncio.sleep(2)  # Wait before retry
                     continue
 
         print(f"❌ All RPC providers failed for address {address}")
         return None
 
+    async def _batch_positions_multicall(self, addresses: List[str],
+                                         block_identifier='latest') -> List[Optional[Dict]]:
+        """Get positions with one Multicall3 aggregate3 eth_call"""
+        provider = await self._get_working_provider()
+        calls = [
+            (self._pool_addr, True, self._calldata[address])  # allowFailure=True
+            for address in addresses
+        ]
+
+        try:
+            started = time.perf_counter()
+            results = await provider['multicall'].functions.aggregate3(calls).call(
+                block_identifier=block_identifier
+            )
+            self._record_success(provider, started)
+        except Exception:
+            self._record_failure(provider)
+            raise
+
+        positions = []
+        retry_indexes = []
+        for i, (address, (success, return_data)) in enumerate(zip(addresses, results)):
+            if success:
+                account_data = eth_abi.decode(self.ACCOUNT_DATA_TYPES, return_data)
+                positions.append(self._parse_account_data(address, account_data, provider['url']))
+            else:
+                positions.append(None)
+                retry_indexes.append(i)
+
+        # Sub-calls that reverted inside the multicall are retried one by one
+        if retry_indexes:
+            retried = await asyncio.gather(
+                *(self.get_position_data(addresses[i], block_identifier) for i in retry_indexes)
+            )
+            for i, pos_data in zip(retry_indexes, retried):
+                positions[i] = pos_data
+
+        return positions
+
+    async def get_positions_batch(self, addresses: List[str], block_identifier='latest') -> List[Dict]:
+        """Get positions with a single JSON-RPC batch request"""
+        provider = await self._get_working_provider()
+        w3 = provider['w3']
+
+        try:
+            started = time.perf_counter()
+            async with w3.batch_requests() as batch:
+                for address in addresses:
+                    batch.add(w3.eth.call({
+                        'to': self._pool_addr,
+                        'data': self._calldata_hex[address]
+                    }, block_identifier))
+                results = await batch.async_execute()
+
+            self._record_success(provider, started)
+        except Exception:
+            self._record_failure(provider)
+            raise
+
+        return [
+            self._parse_account_data(
+                address, eth_abi.decode(self.ACCOUNT_DATA_TYPES, raw), provider['url']
+            )
+            for address, raw in zip(addresses, results)
+        ]
+
+    async def _fetch_positions(self, addresses: List[str], block_identifier='latest') -> List[Optional[Dict]]:
+        """Fetch positions from RPC, batched when possible"""
+        if self.use_multicall:
+            try:
+                return await asyncio.wait_for(self._batch_positions_multicall(addresses, block_identifier), timeout=self.update_interval)
+            except Exception as e:
+                print(f"⚠️  Multicall failed, falling back: {str(e)[:100]}")
+
+        if self.use_batch:
+            try:
+                return await asyncio.wait_for(self.get_positions_batch(addresses, block_identifier), timeout=self.update_interval)
+            except Exception as e:
+                print(f"⚠️  Batch request failed, falling back to single calls: {str(e)[:100]}")
+
+        # Fetch all addresses concurrently; gather keeps input order
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(self.get_position_data(address, block_identifier), timeout=self.update_interval)
+                for address in addresses
+            ),
+            return_exceptions=True
+        )
+
+        positions = []
+        for address, pos_data in zip(addresses, results):
+            if isinstance(pos_data, BaseException):
+                print(f"⚠️  Failed to fetch {address[:8]}...: {str(pos_data)[:100] or type(pos_data).__name__}")
+                pos_data = None
+            positions.append(pos_data)
+
+        return positions
+
+    async def get_block_number(self) -> Optional[int]:
+        """Get the latest block number, None if unavailable"""
+        provider = await self._get_working_provider()
+
+        try:
+            started = time.perf_counter()
+            block_number = await provider['w3'].eth.block_number
+            self._record_success(provider, started)
+            return block_number
+        except Exception as e:
+            self._record_failure(provider)
+            print(f"⚠️  Could not get block number from {provider['url']}: {str(e)[:100]}")
+            return None
+
+    async def get_all_positions(self, block_number: Optional[int] = None) -> List[Optional[Dict]]:
+        """Get positions for all addresses, reusing results already read at this block"""
+        if block_number is None:
+            positions = await self._fetch_positions(self.addresses)
+            self._add_liquidation_prices(positions)
+            return positions
+
+        cached = {}
+        for address in self.addresses:
+            pos_data = self._pos_cache.get((address, block_number))
+            if pos_data is not None:
+                cached[address] = pos_data
+
+        to_fetch = [address for address in self.addresses if address not in cached]
+        if to_fetch:
+            # Read at the cache key's block so the entry matches its label
+            fetched = await self._fetch_positions(to_fetch, block_number)
+            self._add_liquidation_prices(fetched)
+
+            for address, pos_data in zip(to_fetch, fetched):
+                if pos_data is not None:
+                    self._pos_cache[(address, block_number)] = pos_data
+                    cached[address] = pos_data
+        else:
+            print(f"ℹ Block {block_number} unchanged, using cached positions")
+
+        # Drop entries more than two blocks old
+        for key in [key for key in self._pos_cache if key[1] < block_number - 2]:
+            del self._pos_cache[key]
+
+        return [cached.get(address) for address in self.addresses]
+
+    def _add_liquidation_prices(self, positions: List[Optional[Dict]]):
+        """Calculate liquidation price data for fetched positions in place"""
+        positions = [pos for pos in positions if pos is not None]
+
+        if len(positions) < self.VECTORIZE_MIN_POSITIONS:
+            for pos in positions:
+                pos['liquidation_price_data'] = self._calculate_liquidation_price(
+                    pos['collateral_usd'],
+                    pos['debt_usd'],
+                    pos['liquidation_threshold'] / 100,  # Convert to decimal
+                    pos['health_factor']
+                )
+            return
+
+        # Same math as _calculate_liquidation_price, over all positions at once
+        collateral = np.array([pos['collateral_usd'] for pos in positions])
+        debt = np.array([pos['debt_usd'] for pos in positions])
+        liq_threshold = np.array([pos['liquidation_threshold'] for pos in positions])
+        hf = np.array([pos['health_factor'] for pos in positions])
+
+        valid = (collateral != 0) & (debt != 0) & (liq_threshold != 0)
+        with np.errstate(divide='ignore'):
+            ratio = np.where(hf > 0, 1.0 / hf, 0.0)
+        drop = (1.0 - ratio) * 100.0
+
+        for pos, is_valid, r, d in zip(positions, valid.tolist(), ratio.tolist(), drop.tolist()):
+            pos['liquidation_price_data'] = {
+                'liquidation_price_ratio': r,
+                'price_drop_to_liquidation_pct': d,
+                'current_price_normalized': 1.0
+            } if is_valid else None
+
+    def _parse_account_data(self, address: str, account_data, rpc_url: str) -> Dict:
+        """Parse raw getUserAccountData output"""
+        total_collateral = account_data[0] / 1e8
+        total_debt = account_data[1] / 1e8
+        available_borrows = account_data[2] / 1e8
+        liquidation_threshold = account_data[3] / 1e4  # Percentage (e.g., 82.5%)
+        ltv = account_data[4] / 1e4
+        health_factor = account_data[5] / 1e18
+
+        # liquidation_price_data is filled for all positions by _add_liquidation_prices
+        return {
+            "address": address,
+            "collateral_usd": total_collateral,
+            "debt_usd": total_debt,
+            "available_borrows_usd": available_borrows,
+            "health_factor": health_factor,
+            "liquidation_threshold": liquidation_threshold,
+            "ltv": ltv,
+            "liquidation_price_data": None,
+            "timestamp": datetime.now().isoformat(),
+            "rpc_used": rpc_url
+        }
+
     def _format_number(self, num: float, decimals: int = 2) -> str:
         """Format number"""
+        formats = self._NUMBER_FORMATS.get(decimals)
+        if formats is None:
+            formats = self._NUMBER_FORMATS[decimals] = (
+                f"${{:.{decimals}f}}M",
+                f"${{:.{decimals}f}}K",
+                f"${{:.{decimals}f}}"
+            )
+
         if num >= 1_000_000:
-            return f"${num / 1_000_000:.{decimals}f}M"
+            return formats[0].format(num / 1_000_000)
         elif num >= 1_000:
-            return f"${num / 1_000:.{decimals}f}K"
+            return formats[1].format(num / 1_000)
         else:
-            return f"${num:.{decimals}f}"
+            return formats[2].format(num)
+
+    def _format_header(self) -> str:
+        """Format message header with the current timestamp"""
+        return (
+            f"{self._message_header}"
+            f"🕐 <i>{datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>\n"
+            "━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+        )
 
     def _format_message(self, positions: list) -> str:
         """Format message with new layout"""
-        network_emoji = {
-            "ethereum": "🔷",
-            "polygon": "🟣",
-            "arbitrum": "🔵",
-            "optimism": "🔴"
-        }
+        return self._format_header() + self._format_positions(positions)
 
-        emoji = network_emoji.get(self.network, "📊")
-        message = f"{emoji} <b>AAVE Monitor - {self.network.upper()}</b>\n"
-        message += f"🕐 <i>{datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>\n"
-        message += "━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    def _format_positions(self, positions: list) -> str:
+        """Format the position part of the message, without header or timestamp"""
+        out = []
 
         for i, pos in enumerate(positions, 1):
             if pos is None:
@@ -327,18 +827,18 @@ class AAVEMonitorEnhanced:
                 hf_emoji = "🟢"
 
             # Format position
-            message += f"<b>📍 Address:</b>\n"
-            message += f"<code>{addr}</code>\n\n"
+            out.append("<b>📍 Address:</b>\n")
+            out.append(f"<code>{addr}</code>\n\n")
 
             # Links
-            message += f"<b>🔗 Links:</b>\n"
-            message += f"• <a href='https://debank.com/profile/{addr}'>DeBank</a>\n"
-            message += f"• <a href='https://defisim.xyz/ru?address={addr}'>DeFiSim</a>\n\n"
+            out.append("<b>🔗 Links:</b>\n")
+            out.append(f"• <a href='https://debank.com/profile/{addr}'>DeBank</a>\n")
+            out.append(f"• <a href='https://defisim.xyz/ru?address={addr}'>DeFiSim</a>\n\n")
 
             # Metrics
-            message += f"<b>💰 Collateral:</b> {self._format_number(pos['collateral_usd'])}\n"
-            message += f"<b>📉 Debt:</b> {self._format_number(pos['debt_usd'])}\n"
-            message += f"<b>{hf_emoji} Health Factor:</b> {hf:.4f}\n"
+            out.append(f"<b>💰 Collateral:</b> {self._format_number(pos['collateral_usd'])}\n")
+            out.append(f"<b>📉 Debt:</b> {self._format_number(pos['debt_usd'])}\n")
+            out.append(f"<b>{hf_emoji} Health Factor:</b> {hf:.4f}\n")
 
             # Liquidation price
             if pos['liquidation_price_data']:
@@ -346,18 +846,42 @@ class AAVEMonitorEnhanced:
                 price_drop = liq_data['price_drop_to_liquidation_pct']
 
                 if price_drop > 0:
-                    message += f"<b>⚠️ Liquidation Price:</b> -{price_drop:.2f}% from current\n"
+                    out.append(f"<b>⚠️ Liquidation Price:</b> -{price_drop:.2f}% from current\n")
                 else:
-                    message += f"<b>⚠️ Liquidation Price:</b> Already below (HF < 1.0)\n"
+                    out.append("<b>⚠️ Liquidation Price:</b> Already below (HF < 1.0)\n")
 
             # Separator between positions
             if i < len(positions):
-                message += "\n━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+                out.append("\n━━━━━━━━━━━━━━━━━━━━━━━━\n\n")
+
+        return "".join(out)
+
+    async def send_or_update_message(self, text: str, body: Optional[str] = None):
+        """Send or update message, skipped when body (default: text) is unchanged"""
+        if body is None:
+            body = text
+
+        # The header timestamp changes every tick, so only the body is compared
+        text_hash = hashlib.blake2b(body.encode('utf-8'), digest_size=16).digest()
+        if text_hash == self._last_text_hash and self.message_id is not None:
+            print("ℹ No changes to update")
+            return
 
-        return message
+        # Drop this tick's update rather than stalling the monitor loop
+        blocked_for = self._tg_blocked_until - time.monotonic()
+        if blocked_for > 0:
+            print(f"ℹ Telegram rate limited, skipping update ({blocked_for:.0f}s left)")
+            return
+
+        async with self._tg_semaphore:
+            await self._send_or_update_throttled(text, text_hash)
+
+    async def _send_or_update_throttled(self, text: str, text_hash: bytes):
+        """Send or update message, holding the Telegram throttle"""
+        delta = time.monotonic() - self._tg_last_send
+        if delta < 1.0:
+            await asyncio.sleep(1.0 - delta)
 
-    async def send_or_update_message(self, text: str):
-        """Send or update message"""
         try:
             if self.message_id is None:
                 msg = await self.bot.send_message(
@@ -377,15 +901,45 @@ class AAVEMonitorEnhanced:
                     disable_web_page_preview=True
                 )
                 print(f"✓ Updated message (ID: {self.message_id})")
+
+            self._last_text_hash = text_hash
+            self._save_state()
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+
+            print(f"⚠ Telegram rate limit, pausing updates for {retry_after}s")
+            self._tg_blocked_until = time.monotonic() + retry_after
         except TelegramError as e:
             if "message is not modified" in str(e).lower():
                 print("ℹ No changes to update")
+                self._last_text_hash = text_hash
+                self._save_state()
             elif "message to edit not found" in str(e).lower():
                 print("⚠ Message not found, sending new one")
                 self.message_id = None
-                await self.send_or_update_message(text)
+                self._last_text_hash = None
+                self._save_state()
+                self._tg_last_send = time.monotonic()
+                await self._send_or_update_throttled(text, text_hash)
             else:
                 print(f"✗ Telegram error: {e}")
+        finally:
+            self._tg_last_send = time.monotonic()
+
+    def _adjust_poll_interval(self):
+        """Tighten polling when any position is near liquidation, relax when all are safe"""
+        if not self._last_health_factors:
+            return
+
+        min_hf = min(self._last_health_factors)
+        if min_hf < 1.2:
+            self._poll_interval = max(self.min_update_interval, self._poll_interval / 2)
+        elif min_hf > 2.0:
+            self._poll_interval = min(self.max_update_interval, self._poll_interval * 2)
+        else:
+            self._poll_interval = self.update_interval
 
     async def monitor_loop(self):
         """Main monitoring loop"""
@@ -396,23 +950,41 @@ class AAVEMonitorEnhanced:
         print(f"🔄 RPC providers: {len(self.w3_providers)}")
         print("━━━━━━━━━━━━━━━━━━━━━━━━\n")
 
+        loop = asyncio.get_running_loop()
+
         while True:
+            tick_start = loop.time()
+
             try:
-                positions = []
-                for address in self.addresses:
-                    print(f"📊 Fetching data for {address[:8]}...")
-                    pos_data = await self.get_position_data(address)
-                    if pos_data:
-                        positions.append(pos_data)
-                        print(f"   ✓ Using RPC: {pos_data['rpc_used']}")
-
-                if positions:
-                    message = self._format_message(positions)
-                    await self.send_or_update_message(message)
+                block_number = await self.get_block_number()
+
+                # Nothing changed on chain and no position is at risk, skip this tick
+                if (block_number is not None
+                        and block_number == self._last_block_number
+                        and self._last_health_factors
+                        and min(self._last_health_factors) > 1.5):
+                    print(f"ℹ Block {block_number} unchanged, skipping update")
                 else:
-                    print("⚠ No position data fetched")
+                    print(f"📊 Fetching data for {len(self.addresses)} address(es)...")
 
-                await asyncio.sleep(self.update_interval)
+                    positions = []
+                    for pos_data in await self.get_all_positions(block_number):
+                        if pos_data:
+                            positions.append(pos_data)
+                            print(f"   ✓ {pos_data['address'][:8]}... using RPC: {pos_data['rpc_used']}")
+
+                    if positions:
+                        body = self._format_positions(positions)
+                        await self.send_or_update_message(self._format_header() + body, body)
+                    else:
+                        print("⚠ No position data fetched")
+
+                    self._last_block_number = block_number
+                    self._last_health_factors = [pos['health_factor'] for pos in positions]
+                    self._adjust_poll_interval()
+
+                # Subtract the time spent on this tick to keep a constant rate
+                await asyncio.sleep(max(0.0, self._poll_interval - (loop.time() - tick_start)))
 
             except KeyboardInterrupt:
                 print("\n⏹ Stopping monitor...")
@@ -423,13 +995,18 @@ class AAVEMonitorEnhanced:
 
     async def run(self):
         """Run the monitor"""
+        await self._init_web3_providers()
         await self.monitor_loop()
 
 
 async def main():
     """Main entry point"""
     monitor = AAVEMonitorEnhanced("config.json")
-    await monitor.run()
+    try:
+        await monitor.run()
+    finally:
+        # Pooled sessions are shared by every monitor, close them once at exit
+        await close_shared_web3()
 
 
 if __name__ == "__main__":